@@ -0,0 +1,195 @@
+import argparse
+import collections
+import concurrent.futures
+import json
+import sqlite3
+import sys
+import time
+from MonteCarloTreeSearch import *
+from MinimaxAlphaBeta import *
+
+# Part of every cache key; bumped whenever the results for a position change,
+# so that entries written by older versions are not reused
+RESULT_VERSION = 2
+
+
+class ResultCache:
+    """
+    An on-disk cache of analysis results stored in a SQLite file, keyed by the
+    position and the engine configuration used to analyze it.
+    """
+
+    def __init__(self, path, commitEvery = 100):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT)")
+        self.commitEvery = commitEvery
+        self.numUncommitted = 0
+
+
+    def get(self, key):
+        row = self.connection.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+
+    def put(self, key, result):
+        self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?)", (key, json.dumps(result)))
+        self.numUncommitted += 1
+        if self.numUncommitted >= self.commitEvery:
+            self.connection.commit()
+            self.numUncommitted = 0
+
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def analyzePosition(position, config):
+    """
+    Analyzes one position with the engine described by config and returns the best move,
+    its score and search statistics. Runs in the worker processes of the pool.
+    """
+    board, player = Board.fromNotation(position)
+    result = {"position": position, "engine": config["engine"]}
+    start = time.perf_counter()
+
+    if len(board.getAllLegalMoves(player)) == 0:
+        board.movesLeft = False
+        result.update({"move": None, "piece": None, "score": board.evaluateState(player), "stats": {}})
+        return result
+
+    if config["engine"] == "mcts":
+        # Seed from the position so a rerun gives the same answer
+        random.seed("%s %s" % (config["seed"], position))
+        agent = mctsAgent(player)
+        move, piece = agent.mcts(board, player, config["iterations"])
+        root = agent.root
+        best = [child for child in root.getChildren() if child.getMove() == (move, piece)][0]
+        score = best.getNodeScore() / best.getNumVisits() if best.getNumVisits() > 0 else None
+        stats = {"iterations": config["iterations"], "visits": best.getNumVisits(), "children": len(root.getChildren())}
+    else:
+        move, score, piece = alphaMaxValue(player, config["depth"], board, -float("inf"), float("inf"))
+        score = clampScore(score)
+        stats = {"depth": config["depth"]}
+
+    stats["seconds"] = round(time.perf_counter() - start, 6)
+    result.update({"move": list(move), "piece": [int(x) for x in piece], "score": score, "stats": stats})
+    return result
+
+
+def readPositions(stream):
+    """
+    Yields the positions in a stream, one per line, skipping blank lines and "#" comments.
+    """
+    for line in stream:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+def isReady(item):
+    return not isinstance(item, concurrent.futures.Future) or item.done()
+
+
+def analyze(positions, config, output, workers = 1, cache = None, window = None):
+    """
+    Analyzes a stream of positions across a process pool, writing one JSON line per
+    position to output in input order. Positions found in the cache are not analyzed
+    again, and new results are added to it. At most window positions are in flight at
+    once, so arbitrarily long inputs can be streamed.
+    Returns a dictionary counting the positions analyzed, read from the cache and rejected.
+    """
+    window = window or workers * 4
+    configKey = json.dumps(dict(config, version = RESULT_VERSION), sort_keys = True)
+    counts = {"analyzed": 0, "cached": 0, "errors": 0}
+    pending = collections.deque()   # (cache key, position, result or future) in input order
+    inFlight = {}   # futures by cache key, so repeated positions are only analyzed once
+
+    def writeNext():
+        key, position, item = pending.popleft()
+        if isinstance(item, concurrent.futures.Future):
+            first = inFlight.get(key) is item
+            if first:
+                del inFlight[key]
+            try:
+                result = dict(item.result())
+            except Exception as e:
+                # A failed analysis is reported on its own line and not cached
+                result = {"position": position, "error": "%s: %s" % (type(e).__name__, e)}
+                counts["errors"] += 1
+            else:
+                if first:
+                    counts["analyzed"] += 1
+                    if cache is not None:
+                        cache.put(key, result)
+                result["cached"] = False
+        else:
+            result = item
+        output.write(json.dumps(result) + "\n")
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+        for position in positions:
+            # Normalize the notation so equivalent spellings share a cache entry
+            try:
+                board, player = Board.fromNotation(position)
+                position = board.toNotation(player)
+            except ValueError as e:
+                pending.append((None, position, {"position": position, "error": str(e)}))
+                counts["errors"] += 1
+                position = None
+
+            if position is not None:
+                key = configKey + " " + position
+                result = cache.get(key) if cache is not None else None
+                if result is not None:
+                    result["cached"] = True
+                    pending.append((key, position, result))
+                    counts["cached"] += 1
+                else:
+                    if key not in inFlight:
+                        inFlight[key] = pool.submit(analyzePosition, position, config)
+                    pending.append((key, position, inFlight[key]))
+
+            while len(pending) > window or (pending and isReady(pending[0][2])):
+                writeNext()
+
+        while pending:
+            writeNext()
+
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Analyze a file of positions written in Board notation.")
+    parser.add_argument("input", nargs = "?", default = "-", help = "Position file, one per line ('-' for stdin)")
+    parser.add_argument("--output", default = "-", help = "JSONL output file ('-' for stdout)")
+    parser.add_argument("--engine", choices = ["mcts", "alphabeta"], default = "mcts")
+    parser.add_argument("--iterations", type = int, default = 100, help = "MCTS iterations per position")
+    parser.add_argument("--depth", type = int, default = 3, help = "Alpha-beta search depth")
+    parser.add_argument("--seed", type = int, default = 0, help = "Random seed for MCTS")
+    parser.add_argument("--workers", type = int, default = 1)
+    parser.add_argument("--cache", default = None, help = "SQLite file used to cache results between runs")
+    args = parser.parse_args()
+    if args.iterations < 1 or args.depth < 1:
+        parser.error("--iterations and --depth must be at least 1")
+
+    if args.engine == "mcts":
+        config = {"engine": "mcts", "iterations": args.iterations, "seed": args.seed}
+    else:
+        config = {"engine": "alphabeta", "depth": args.depth}
+
+    input = sys.stdin if args.input == "-" else open(args.input)
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    cache = ResultCache(args.cache) if args.cache else None
+    start = time.perf_counter()
+    try:
+        counts = analyze(readPositions(input), config, output, args.workers, cache)
+    finally:
+        if cache is not None:
+            cache.close()
+        output.flush()
+
+    counts["seconds"] = round(time.perf_counter() - start, 3)
+    print(json.dumps(counts), file = sys.stderr)
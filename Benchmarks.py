@@ -0,0 +1,252 @@
+import sys
+import time
+from ParallelAlphaBeta import *
+from MonteCarloTreeSearch import *
+from LockstepMCTS import *
+
+
+def randomPositions(count, plies, seed = 0, size = 6):
+    """
+    Returns a list of (board, player) pairs reached by playing a number of
+    random moves from the starting position.
+    """
+    random.seed(seed)
+    positions = []
+
+    while len(positions) < count:
+        board = Board(size)
+        player = AGENT
+        for i in range(plies):
+            move, piece = board.randomMove(player)
+            if move is None: break
+            board.move(piece, move)
+            player = board.nextPlayer(player)
+        if board.isTerminal()[0] or len(board.getAllLegalMoves(player)) == 0:
+            continue
+        positions.append((board, player))
+
+    return positions
+
+
+def parallelAlphaBetaSpeedup(depth = 6, workerCounts = (1, 2, 4), numPositions = 4):
+    """
+    Measures the time taken by the Lazy SMP alpha-beta search to reach a fixed depth
+    over a set of positions as the number of worker processes grows, with the speedup
+    taken against the sequential alphaMaxValue. With two or more workers, odd-numbered
+    helpers search one ply deeper and the deepest completed result is returned, so the
+    last column gives the depth each position's result came from.
+    """
+    positions = randomPositions(numPositions, 6)
+
+    print("Lazy SMP alpha-beta, depth %d, %d positions" % (depth, len(positions)))
+    print("%10s %10s %10s %12s  %s" % ("workers", "seconds", "speedup", "nodes/sec", "depths"))
+
+    # Nodes of the sequential search are counted as positions generated with testMove
+    CountingBoard.numNodes = 0
+    start = time.perf_counter()
+    for board, player in positions:
+        countingBoard = CountingBoard(board.size)
+        countingBoard.setBoard(board.getBoard().copy())
+        alphaMaxValue(player, depth, countingBoard, -float("inf"), float("inf"))
+    baseline = time.perf_counter() - start
+    print("%10s %10.3f %10.2f %12.0f  %s" % ("sequential", baseline, 1.0, CountingBoard.numNodes / baseline,
+                                             " ".join([str(depth)] * len(positions))))
+
+    for workers in workerCounts:
+        nodes = 0
+        depths = []
+        start = time.perf_counter()
+        for board, player in positions:
+            stats = {}
+            parallelAlphaMaxValue(player, depth, board, workers, stats = stats)
+            nodes += stats["nodes"]
+            depths.append(str(stats["depth"]))
+        elapsed = time.perf_counter() - start
+
+        print("%10d %10.3f %10.2f %12.0f  %s" % (workers, elapsed, baseline / elapsed, nodes / elapsed, " ".join(depths)))
+
+
+def playSelfPlayGame(agents, iterations, maxMoves = 100, firstPlayer = AGENT):
+    """
+    Plays one game between two mctsAgents, stopping early after maxMoves moves.
+    """
+    board = Board()
+    board.turn = firstPlayer
+    turn = firstPlayer
+    count = 0
+
+    while not board.isTerminal()[0] and count < maxMoves:
+        if len(board.getAllLegalMoves(turn)) == 0:
+            board.movesLeft = False
+            break
+        move, piece = agents[turn].mcts(board, turn, iterations)
+        board.move(piece, move)
+        turn = board.changeTurn()
+        count += 1
+
+    return board
+
+
+def canonicalPositionReduction(numGames = 20, iterations = 20):
+    """
+    Plays batches of self-play games between mctsAgents sharing one statistics table
+    and compares the number of positions stored under canonical keys with the number
+    of distinct positions the agents would have stored without color-flip symmetry.
+    A position only has a stored mirror image if the other color can reach it with
+    the other side to move, so games where AGENT always moves first share nothing;
+    the second batch alternates which color moves first.
+    """
+    print("Color-flip canonicalization, %d self-play games, %d iterations per move" % (numGames, iterations))
+    print("%-22s %12s %12s %10s" % ("first mover", "distinct", "canonical", "reduction"))
+    for alternate in (False, True):
+        random.seed(0)
+        statsTable = {}
+        rawKeys = set()
+
+        for i in range(numGames):
+            agents = {AGENT: mctsAgent(AGENT, statsTable), OPP: mctsAgent(OPP, statsTable)}
+            playSelfPlayGame(agents, iterations, firstPlayer = OPP if alternate and i % 2 else AGENT)
+
+            for agent in agents.values():
+                for node in agent.gameTree.values():
+                    board = Board()
+                    board.setBoard(node.getState())
+                    rawKeys.add((board.getHash(node.getPlayer()), agent.player))
+
+        print("%-22s %12d %12d %9.1f%%" % ("alternating" if alternate else "always " + AGENT, len(rawKeys),
+                                          len(statsTable), 100 * (1 - len(statsTable) / len(rawKeys))))
+
+
+def ponderingReuse(iterations = 50, depth = 4, thinkTime = 0.5, maxMoves = 30):
+    """
+    Plays one game between a pondering mctsAgent and alpha-beta, as in Tests.py,
+    and reports how many iterations the agent pondered while alpha-beta was thinking
+    and how many of them were spent below the reply alpha-beta actually played.
+    Alpha-beta takes at least thinkTime seconds per move, like an opponent on the
+    other end of a connection; on its own it answers within milliseconds and
+    leaves nothing to ponder in.
+    """
+    random.seed(0)
+    board = Board()
+    turn = AGENT
+    agent = mctsAgent(AGENT, ponder = True)
+
+    while not board.isTerminal()[0] and len(agent.searchHistory) < maxMoves:
+        if turn == AGENT:
+            move, piece = agent.mcts(board, AGENT, iterations)
+        else:
+            start = time.perf_counter()
+            move, score, piece, = alphaMaxValue(OPP, depth, board, -float("inf"), float("inf"))
+            time.sleep(max(0, thinkTime - (time.perf_counter() - start)))
+            if move == None:
+                board.movesLeft = False
+                break
+        board.move(piece, move)
+        turn = board.changeTurn()
+    agent.stopPondering()
+
+    print("Pondering, %d iterations per move against alpha-beta depth %d thinking %.1fs" % (iterations, depth, thinkTime))
+    print("%6s %12s %12s %12s" % ("move", "searched", "pondered", "reused"))
+    for i, search in enumerate(agent.searchHistory):
+        print("%6d %12d %12d %12d" % (i + 1, search["iterations"], search["ponderIterations"], search["ponderHits"]))
+
+    # The first search has nothing pondered before it
+    pondered = sum(search["ponderIterations"] for search in agent.searchHistory[:-1])
+    reused = sum(search["ponderHits"] for search in agent.searchHistory)
+    print("%d of %d pondered iterations (%.1f%%) were below the reply played" % (reused, pondered, 100 * reused / max(pondered, 1)))
+
+
+class CountingBoard(Board):
+    """
+    A board that counts every position generated with testMove, used to
+    measure how many nodes a search visits.
+    """
+    numNodes = 0
+
+    def testMove(self, loc, move):
+        CountingBoard.numNodes += 1
+        return Board.testMove(self, loc, move)
+
+
+def boardScaling(sizes = (6, 8, 10), iterations = 50, depth = 3, numPositions = 10, seconds = 1.0):
+    """
+    Reports move generation calls per second, MCTS iterations per second
+    and alpha-beta nodes per second for each board size.
+    """
+    print("Board scaling, MCTS %d iterations, alpha-beta depth %d, %d positions" % (iterations, depth, numPositions))
+    print("%6s %14s %14s %14s" % ("size", "movegen/sec", "mcts iter/sec", "ab nodes/sec"))
+    for size in sizes:
+        positions = randomPositions(numPositions, size // 2, size = size)
+
+        calls = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            for board, player in positions:
+                board.getAllLegalMoves(player)
+            calls += len(positions)
+        moveGenRate = calls / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for board, player in positions:
+            mctsAgent(player).mcts(board, player, iterations)
+        mctsRate = iterations * len(positions) / (time.perf_counter() - start)
+
+        CountingBoard.numNodes = 0
+        start = time.perf_counter()
+        for board, player in positions:
+            countingBoard = CountingBoard(size)
+            countingBoard.setBoard(board.getBoard().copy())
+            alphaMaxValue(player, depth, countingBoard, -float("inf"), float("inf"))
+        alphaBetaRate = CountingBoard.numNodes / (time.perf_counter() - start)
+
+        print("%6d %14.0f %14.0f %14.0f" % (size, moveGenRate, mctsRate, alphaBetaRate))
+
+
+def lockstepThroughput(numGames = 64, iterations = 50, numMoves = 4, leavesPerGame = 1):
+    """
+    Compares the playouts per second of searching many self-play games one after
+    another with mcts against searching them together with LockstepMCTS.
+    """
+    print("Lockstep MCTS, %d games, %d iterations per move, %d moves per game" % (numGames, iterations, numMoves))
+    print("%-12s %10s %14s" % ("mode", "seconds", "playouts/sec"))
+    for mode in ("sequential", "lockstep"):
+        random.seed(0)
+        boards = [Board() for i in range(numGames)]
+        agents = [{AGENT: mctsAgent(AGENT), OPP: mctsAgent(OPP)} for i in range(numGames)]
+        scheduler = LockstepMCTS(leavesPerGame = leavesPerGame)
+        playouts = 0
+        elapsed = 0
+
+        for i in range(numMoves):
+            games = [(agents[j][board.turn], board, board.turn) for j, board in enumerate(boards)
+                     if not board.isTerminal()[0] and len(board.getAllLegalMoves(board.turn)) > 0]
+
+            start = time.perf_counter()
+            if mode == "sequential":
+                moves = [agent.mcts(board, player, iterations) for agent, board, player in games]
+            else:
+                moves = scheduler.search(games, iterations)
+            elapsed += time.perf_counter() - start
+            playouts += len(games) * iterations
+
+            for (agent, board, player), (move, piece) in zip(games, moves):
+                board.move(piece, move)
+                board.changeTurn()
+
+        print("%-12s %10.3f %14.0f" % (mode, elapsed, playouts / elapsed))
+
+
+BENCHMARKS = {
+    "parallel-alphabeta": parallelAlphaBetaSpeedup,
+    "canonical-positions": canonicalPositionReduction,
+    "pondering": ponderingReuse,
+    "board-scaling": boardScaling,
+    "lockstep": lockstepThroughput,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+        print()
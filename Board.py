@@ -2,25 +2,112 @@ import numpy as np
 import random
 from Constants import *
 
+# Zobrist keys are generated lazily for each board shape from a fixed seed so
+# every process (and every run) derives the same hash for the same position.
+ZOBRIST_SEED = 0x5EED
+zobristTables = {}
+
+
+def getZobristTable(shape):
+    """
+    Returns the Zobrist key tables for a board of the given shape.
+    Rows 0-3 of pieceKeys hold the keys for pieces -2, -1, 1 and 2.
+    flippedKeys holds the same keys for the board rotated 180 degrees with the
+    piece colors swapped, so the hash of the color-flipped board can be computed
+    without building it. oppKey is xored in when it is the opponent's turn and
+    perspectiveKey when statistics are kept for the player not on move.
+    """
+    if shape not in zobristTables:
+        rng = np.random.default_rng(ZOBRIST_SEED + shape[0] * 64 + shape[1])
+        pieceKeys = rng.integers(1, 2**63, size=(4,) + shape, dtype=np.uint64)
+        flippedKeys = pieceKeys[::-1, ::-1, ::-1].copy()
+        oppKey = np.uint64(rng.integers(1, 2**63, dtype=np.uint64))
+        perspectiveKey = np.uint64(rng.integers(1, 2**63, dtype=np.uint64))
+        zobristTables[shape] = (pieceKeys, flippedKeys, oppKey, perspectiveKey)
+
+    return zobristTables[shape]
+
+
+# Characters used for pieces and the player to move in Board.toNotation
+NOTATION_PIECES = {1: "a", 2: "A", -1: "o", -2: "O"}
+NOTATION_VALUES = {char: piece for piece, char in NOTATION_PIECES.items()}
+NOTATION_PLAYERS = {AGENT: "a", OPP: "o"}
+
+
+class BoardGeometry:
+    """
+    Holds everything about a board that depends only on its size, computed once per size
+    and shared by all boards of that size.
+    Each player starts with pieces on the dark squares of the (size - 2) / 2 rows
+    nearest to them, leaving two empty rows in the middle of the board.
+    """
+
+    def __init__(self, size):
+        if size < 4 or size % 2 != 0:
+            raise ValueError("Board size must be an even number of at least 4, not %r" % size)
+
+        self.size = size
+        self.maxIndex = size - 1
+        self.pieceRows = (size - 2) // 2
+        self.numPieces = self.pieceRows * size // 2
+        self.half = size // 2   # rows below this index are on the opponent's side of the board
+
+        # Starting position: pieces sit on squares where row + column is odd
+        self.startBoard = np.zeros((size, size), dtype = 'int8')
+        for x in range(size):
+            for y in range(size):
+                if (x + y) % 2 == 1:
+                    if x < self.pieceRows:
+                        self.startBoard[x, y] = -1
+                    elif x >= size - self.pieceRows:
+                        self.startBoard[x, y] = 1
+
+        # Directions that stay on the board from each square
+        self.directionsInBounds = {}
+        for x in range(size):
+            for y in range(size):
+                directions = set()
+                if x - 1 >= 0 and y + 1 < size: directions.add(NORTHEAST)
+                if x - 1 >= 0 and y - 1 >= 0: directions.add(NORTHWEST)
+                if x + 1 < size and y + 1 < size: directions.add(SOUTHEAST)
+                if x + 1 < size and y - 1 >= 0: directions.add(SOUTHWEST)
+                self.directionsInBounds[(x, y)] = directions
+
+
+geometries = {}
+
+
+def getGeometry(size):
+    """
+    Returns the BoardGeometry for a board of the given size.
+    """
+    if size not in geometries:
+        geometries[size] = BoardGeometry(size)
+
+    return geometries[size]
+
+
 class Board:
     """
     A board object acts as the playing surface for the agents playing checkers.
-    Each board is made up of a 6x6 array initialized to the starting position of checkers
-    with functions to ensure the rules of checkers are enforced regarding legal moves 
-    that can be made.
+    Each board is made up of a square array (6x6 by default) initialized to the starting
+    position of checkers with functions to ensure the rules of checkers are enforced
+    regarding legal moves that can be made.
     A board object also contains variables and functions used to evaluate
     the current game state in regards to whether a given agent is winning or losing.
     """
     
-    def __init__(self):
+    def __init__(self, size = 6):
+        self.size = size
+        self.geometry = getGeometry(size)
         self.board = self.generateBoard()
         self.turn = AGENT
         self.movesLeft = True   # tracks if a player has legal moves left to make
         self.pieceCount = {}
         self.kingCount = {}
         
-        self.pieceCount[AGENT] = 6
-        self.pieceCount[OPP] = 6
+        self.pieceCount[AGENT] = self.geometry.numPieces
+        self.pieceCount[OPP] = self.geometry.numPieces
         
         self.kingCount[AGENT] = 0
         self.kingCount[OPP] = 0
@@ -28,22 +115,81 @@ class Board:
         
     def generateBoard(self):
         """
-        Creates a new 6x6 board and initializes starting position of pieces.
+        Creates a new board of the current size and initializes starting position of pieces.
         """
+        return self.geometry.startBoard.copy()
 
-        board = np.zeros((6,6), dtype = 'int8')
-
-        # Initialize starting position of opponent's pieces
-        board[0:2, 1::2] = -1
-        board[1, :] = 0
-        board[1, ::2] = -1
 
-        # Intialize starting position of agent's pieces
-        board[4:6, ::2] = 1
-        board[4, ::2] = 0
-        board[4, 1::2] = 1
-        
-        return board
+    def toNotation(self, player):
+        """
+        Returns a compact text form of the board with the given player to move.
+        Rows are listed from row 0 and separated by "/", with "a"/"A" for the agent's
+        pieces/kings, "o"/"O" for the opponent's, and runs of empty squares written
+        as numbers. The player to move ("a" or "o") follows after a space, e.g. the
+        starting position is "1o1o1o/o1o1o1/6/6/1a1a1a/a1a1a1 a".
+        """
+        rows = []
+        for row in self.board:
+            text = ""
+            empty = 0
+            for piece in row:
+                if piece == 0:
+                    empty += 1
+                    continue
+                if empty > 0:
+                    text += str(empty)
+                    empty = 0
+                text += NOTATION_PIECES[piece]
+            if empty > 0:
+                text += str(empty)
+            rows.append(text)
+
+        return "/".join(rows) + " " + NOTATION_PLAYERS[player]
+
+
+    @staticmethod
+    def fromNotation(text):
+        """
+        Parses the text form written by toNotation.
+        Returns the board along with the player to move, and raises ValueError
+        if the text is not a valid position.
+        """
+        fields = text.split()
+        if len(fields) != 2 or fields[1] not in NOTATION_PLAYERS.values():
+            raise ValueError("Expected '<rows> <a|o>', got %r" % text)
+        player = AGENT if fields[1] == NOTATION_PLAYERS[AGENT] else OPP
+
+        rows = []
+        for rowText in fields[0].split("/"):
+            row = []
+            digits = ""
+            for char in rowText + "/":
+                if char.isdigit():
+                    digits += char
+                    continue
+                if digits:
+                    row.extend([0] * int(digits))
+                    digits = ""
+                if char == "/":
+                    break
+                if char not in NOTATION_VALUES:
+                    raise ValueError("Unknown piece %r in %r" % (char, text))
+                row.append(NOTATION_VALUES[char])
+            rows.append(row)
+
+        size = len(rows)
+        if any(len(row) != size for row in rows):
+            raise ValueError("Rows of %r do not form a square board" % text)
+
+        board = Board(size)
+        board.setBoard(np.array(rows, dtype = 'int8'))
+        board.turn = player
+        board.pieceCount[AGENT] = int(np.sum(board.board > 0))
+        board.pieceCount[OPP] = int(np.sum(board.board < 0))
+        board.kingCount[AGENT] = int(np.sum(board.board == 2))
+        board.kingCount[OPP] = int(np.sum(board.board == -2))
+
+        return board, player
 
 
     def getBoard(self):
@@ -56,8 +202,94 @@ class Board:
     def setBoard(self, board):
         """
         Sets the current board to the board given in the argument.
+        If the given board is a different size, the board's geometry
+        and piece counts are changed to match it.
         """
         self.board = board
+        if board.shape[0] != self.size:
+            self.size = board.shape[0]
+            self.geometry = getGeometry(self.size)
+            self.pieceCount[AGENT] = self.geometry.numPieces
+            self.pieceCount[OPP] = self.geometry.numPieces
+
+
+    def getHash(self, player):
+        """
+        Returns a 64-bit Zobrist hash of the current board with the given player to move.
+        Used as the key for transposition tables.
+        """
+        pieceKeys, flippedKeys, oppKey, perspectiveKey = getZobristTable(self.board.shape)
+        key = self.hashPieces(pieceKeys)
+        if player == OPP:
+            key ^= int(oppKey)
+
+        return key
+
+
+    def getCanonicalHash(self, player, perspective = None):
+        """
+        Returns the hash of the canonical form of the current board with the given player to move.
+        A position with the opponent to move is strategically identical to the same position
+        rotated 180 degrees with the colors of the pieces swapped and the agent to move, so both
+        are given the same hash. If a perspective player is given, the hash also records
+        whether that player is the one on move, so that statistics kept for one color can be
+        shared with an agent playing the other color.
+        """
+        pieceKeys, flippedKeys, oppKey, perspectiveKey = getZobristTable(self.board.shape)
+        if player == AGENT:
+            key = self.hashPieces(pieceKeys)
+        else:
+            key = self.hashPieces(flippedKeys)
+        if perspective is not None and perspective != player:
+            key ^= int(perspectiveKey)
+
+        return key
+
+
+    def hashPieces(self, keyTable):
+        """
+        Returns the xor of the keys in the given table for every piece on the board.
+        """
+        index = self.board.astype(np.int64)
+        occupied = index != 0
+        index = np.where(index > 0, index + 1, index + 2)  # -2, -1, 1, 2 -> 0, 1, 2, 3
+
+        keys = np.take_along_axis(keyTable, index[np.newaxis], axis=0)[0]
+        return int(np.bitwise_xor.reduce(keys[occupied], initial=np.uint64(0)))
+
+
+    def flipColors(self):
+        """
+        Returns a new board with the current board rotated 180 degrees and the roles
+        of the two players swapped. Used to check and translate canonical positions.
+        """
+        flipped = Board(self.size)
+        flipped.setBoard(-self.board[::-1, ::-1])
+        flipped.turn = self.nextPlayer(self.turn)
+        flipped.movesLeft = self.movesLeft
+        flipped.pieceCount = {AGENT: self.pieceCount[OPP], OPP: self.pieceCount[AGENT]}
+        flipped.kingCount = {AGENT: self.kingCount[OPP], OPP: self.kingCount[AGENT]}
+
+        return flipped
+
+
+    def flipLocation(self, loc):
+        """
+        Returns where the given location ends up when the board is rotated 180 degrees.
+        """
+        x, y = loc
+        rows, cols = self.board.shape
+
+        return (rows - 1 - x, cols - 1 - y)
+
+
+    def flipMove(self, move, loc):
+        """
+        Returns the (move, location) pair that performs the given move on the color-flipped board.
+        """
+        direction, jump = move
+
+        return (FLIPPED_DIRECTIONS[direction], jump), self.flipLocation(loc)
 
 
     def getPieceCount(self, player):
@@ -82,7 +314,7 @@ class Board:
         out of the back row and opening up a king opportunity for the opponent.
         """
         if player == AGENT:
-            return np.sum(self.board[5] == 1)
+            return np.sum(self.board[self.geometry.maxIndex] == 1)
         else:
             return np.sum(self.board[0] == -1)
 
@@ -92,13 +324,14 @@ class Board:
         Returns a list containing the location of the remaining pieces the given player has.
         """
         pieces = []
+        maxIndex = self.geometry.maxIndex
         x = 0
         y = 0
         
         for row in self.board:
-            if x > 5: x = 0
+            if x > maxIndex: x = 0
             for piece in row:
-                if y > 5: y = 0
+                if y > maxIndex: y = 0
                 if player == AGENT: # if it is the agent's turn, get location of all pieces greater than 0
                     if piece > 0:  
                         loc = (x,y)
@@ -120,16 +353,17 @@ class Board:
         Used to determine the value of a state.
         """
         pieces = self.getPieces(player)
+        half = self.geometry.half
         count = 0
 
         if player == AGENT:
             for piece in pieces:
                 x, y = piece
-                if x < 3: count += 1
+                if x < half: count += 1
         else:
             for piece in pieces:
                 x, y = piece
-                if x > 2: count += 1
+                if x >= half: count += 1
 
         return count
 
@@ -141,12 +375,6 @@ class Board:
         if self.board[loc] == 0:
             return None
 
-        # Get x and y coordinates of the current piece's location on the board
-        x, y = loc
-
-        # Create an empty list used to keep track of illegal moves
-        illMoves = []
-
         # If current piece is a king, start with all legal moves
         # otherwise assign appropriate moves to start
         if self.isKing(self.board, loc):
@@ -157,16 +385,9 @@ class Board:
             else:
                 moves = [SOUTHEAST, SOUTHWEST]
 
-        if x - 1 < 0:
-            illMoves.extend([NORTHEAST, NORTHWEST])
-        if x + 1 > 5:
-            illMoves.extend([SOUTHEAST, SOUTHWEST])
-        if y - 1 < 0:
-            illMoves.extend([NORTHWEST, SOUTHWEST])
-        if y + 1 > 5:
-            illMoves.extend([NORTHEAST, SOUTHEAST])
-            
-        moves = [ele for ele in moves if ele not in illMoves]
+        # Keep only the moves that stay on the board from this square
+        inBounds = self.geometry.directionsInBounds[loc]
+        moves = [ele for ele in moves if ele in inBounds]
         
         return moves
     
@@ -196,7 +417,8 @@ class Board:
         Used when a jump is performed by a player.
         """
         x, y = loc
-        if x > 5 or x < 0 or y > 5 or y < 0:
+        maxIndex = self.geometry.maxIndex
+        if x > maxIndex or x < 0 or y > maxIndex or y < 0:
             return False
         
         return True
@@ -255,7 +477,7 @@ class Board:
         Used to test the value of different available moves in Monte Carlo Tree Search,
         Alpha-Beta, and Minimax algorithms.
         """
-        newBoard = Board()
+        newBoard = self.__class__(self.size)
         newBoard.setBoard(self.board.copy())
 
         newBoard.move(loc, move)
@@ -306,7 +528,7 @@ class Board:
             if turn == AGENT and x == 0:    # if it is the agent's turn and their piece reaches the opponent's back row
                 self.board[finalLoc] = 2
                 self.kingCount[AGENT] += 1
-            elif turn == OPP and x == 5:   # if it is the opponent's turn and their piece reaches the agent's back row
+            elif turn == OPP and x == self.geometry.maxIndex:   # if it is the opponent's turn and their piece reaches the agent's back row
                 self.board[finalLoc] = -2
                 self.kingCount[OPP] +=1
         
@@ -337,7 +559,7 @@ class Board:
         Selects the first available move that a player has.
         Used for performance testing of other algorithms.
         """
-        pieces = self.getPieces(player, self.board)
+        pieces = self.getPieces(player)
         piece = None
 
         for i in range(len(pieces)):
@@ -427,3 +649,35 @@ class Board:
             winner = AGENT
 
         return gameOver, winner
+
+
+def evaluateStates(boards, players):
+    """
+    Returns the value of each board for the matching player, the same as calling
+    evaluateState on each one, but with the terms that depend on the pieces on the
+    board computed for the whole batch at once. All boards must be the same size.
+    """
+    states = np.stack([board.getBoard() for board in boards])
+    agentView = np.array([player == AGENT for player in players])
+    half = boards[0].geometry.half
+
+    agentPieces = (states > 0).sum(axis = (1, 2))
+    oppPieces = (states < 0).sum(axis = (1, 2))
+    agentTerritory = (states[:, :half] > 0).sum(axis = (1, 2))
+    oppTerritory = (states[:, half:] < 0).sum(axis = (1, 2))
+
+    # Terminal states, following isTerminal: the opponent losing takes precedence
+    movesLeft = np.array([board.movesLeft for board in boards])
+    agentTurn = np.array([board.turn == AGENT for board in boards])
+    agentLost = (agentPieces == 0) | (~movesLeft & agentTurn)
+    oppLost = (oppPieces == 0) | (~movesLeft & ~agentTurn)
+    terminalValues = np.where(oppLost == agentView, 100, -100)
+
+    counts = []
+    for board, player in zip(boards, players):
+        enemy = board.nextPlayer(player)
+        counts.append(board.getPieceCount(player) + (2 * board.getKingCount(player))
+                      - board.getPieceCount(enemy) - (2 * board.getKingCount(enemy)))
+    values = np.array(counts) + np.where(agentView, agentTerritory, oppTerritory)
+
+    return np.where(agentLost | oppLost, terminalValues, values).tolist()
@@ -7,3 +7,11 @@ SOUTHWEST = "southwest"
 # Different turns
 AGENT = "agent"
 OPP = "opposition"
+
+# Direction a move takes once the board is rotated 180 degrees
+FLIPPED_DIRECTIONS = {
+    NORTHEAST: SOUTHWEST,
+    NORTHWEST: SOUTHEAST,
+    SOUTHEAST: NORTHWEST,
+    SOUTHWEST: NORTHEAST,
+}
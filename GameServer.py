@@ -0,0 +1,476 @@
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import time
+import concurrent.futures
+import multiprocessing
+from MonteCarloTreeSearch import *
+from ParallelAlphaBeta import *
+
+# Number of recent search latencies kept for the percentile statistics
+LATENCY_WINDOW = 10000
+
+
+def percentiles(values, points = (50, 90, 99)):
+    """
+    Returns the given percentiles of a list of values, in milliseconds.
+    """
+    if len(values) == 0:
+        return {"p%d" % point: None for point in points}
+
+    values = sorted(values)
+    result = {}
+    for point in points:
+        index = min(len(values) - 1, int(round(point / 100 * (len(values) - 1))))
+        result["p%d" % point] = round(values[index] * 1000, 3)
+
+    return result
+
+
+class AbortableBoard(Board):
+    """
+    A board that ends the alpha-beta search running on it by raising SearchAborted
+    from testMove once the stop event is set or the deadline has passed. The
+    positions of the search are all created with testMove, so they are AbortableBoards too.
+    """
+    stop = None
+    deadline = None
+    numMoves = 0
+
+    def testMove(self, loc, move):
+        AbortableBoard.numMoves += 1
+        if AbortableBoard.numMoves % 256 == 0:
+            if AbortableBoard.deadline is not None and time.perf_counter() >= AbortableBoard.deadline:
+                raise SearchAborted()
+            if AbortableBoard.stop is not None and AbortableBoard.stop.is_set():
+                raise SearchAborted()
+        return Board.testMove(self, loc, move)
+
+
+def runEngine(board, agent, player, engine, iterations, depth, timeLimit, stop):
+    """
+    Chooses a move for the given player. Runs inside a worker process of the
+    server's pool, so the (possibly updated) mctsAgent is returned along with the move;
+    alpha-beta requests are given no agent and return None in its place. The search
+    ends early once the stop event (a multiprocessing.Manager Event) is set.
+    """
+    if engine == "mcts":
+        move, piece = agent.mcts(board, player, iterations, timeLimit, stop)
+        return move, piece, None, agent
+
+    searchBoard = AbortableBoard(board.size)
+    searchBoard.setBoard(board.getBoard().copy())
+    searchBoard.turn = board.turn
+    searchBoard.movesLeft = board.movesLeft
+    searchBoard.pieceCount = dict(board.pieceCount)
+    searchBoard.kingCount = dict(board.kingCount)
+
+    # Alpha-beta deepens one ply at a time, and the deepest depth completed
+    # before the time limit is used. The first depth always completes.
+    deadline = None
+    if timeLimit is not None:
+        deadline = time.perf_counter() + timeLimit
+    AbortableBoard.stop = stop
+    AbortableBoard.deadline = None
+
+    move, score, piece = None, None, None
+    for currentDepth in range(1, depth + 1):
+        try:
+            move, score, piece = alphaMaxValue(player, currentDepth, searchBoard, -float("inf"), float("inf"))
+        except SearchAborted:
+            break
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        AbortableBoard.deadline = deadline
+
+    AbortableBoard.stop = None
+    AbortableBoard.deadline = None
+    return move, piece, score, None
+
+
+class Game:
+    """
+    The state kept by the server for one game: the board and the
+    mctsAgent of each player, so their trees are reused between moves.
+    """
+
+    def __init__(self, gameId, maxNodes, size = 6):
+        self.gameId = gameId
+        self.board = Board(size)
+        self.agents = {AGENT: mctsAgent(AGENT, maxNodes = maxNodes), OPP: mctsAgent(OPP, maxNodes = maxNodes)}
+        self.lock = asyncio.Lock()
+        self.numMoves = 0
+
+
+    def getState(self):
+        """
+        Returns a JSON-serializable description of the game.
+        """
+        gameOver, winner = self.board.isTerminal()
+        return {
+            "game": self.gameId,
+            "board": self.board.getBoard().tolist(),
+            "turn": self.board.turn,
+            "moves": self.numMoves,
+            "gameOver": gameOver,
+            "winner": winner,
+        }
+
+
+    def play(self, piece, move):
+        """
+        Performs a move for the player whose turn it is. Returns an error message if the move is illegal.
+        """
+        if self.board.isTerminal()[0]:
+            return "Game is over"
+        if (move, piece) not in self.board.getAllLegalMoves(self.board.turn):
+            return "Not a legal move"
+
+        self.board.move(piece, move)
+        self.board.changeTurn()
+        self.numMoves += 1
+        if len(self.board.getAllLegalMoves(self.board.turn)) == 0:
+            self.board.movesLeft = False
+
+        return None
+
+
+class GameServer:
+    """
+    An asyncio server hosting many concurrent games over a line-delimited JSON protocol.
+    Engine searches run in a bounded process pool so the event loop never blocks.
+
+    Every request is a JSON object on one line with an "op" and an optional "id" that
+    is echoed back in the reply. Replies carry "ok" and either the result or an "error".
+        new_game  size (optional, default 6)                     -> game state
+        state     game                                           -> game state
+        move      game, piece [x, y], move [direction, jump]     -> game state
+        play      game, engine ("mcts" | "alphabeta"), iterations, depth, timeLimit
+                                                                 -> chosen move and game state
+        cancel    target (id of an earlier request on this connection)
+        close_game game
+        stats                                                    -> queue depth and latency percentiles
+    """
+
+    def __init__(self, workers = None, maxNodes = 5000, defaultIterations = 50, defaultDepth = 3):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers = self.workers)
+        # Stop events for the searches in the pool, which can only be passed to workers through a manager
+        self.manager = multiprocessing.Manager()
+        self.maxNodes = maxNodes
+        self.defaultIterations = defaultIterations
+        self.defaultDepth = defaultDepth
+
+        self.games = {}
+        self.gameIds = itertools.count(1)
+        self.inFlight = 0
+        self.numSearches = 0
+        self.numCancelled = 0
+        self.numTimeouts = 0
+        self.latencies = collections.deque(maxlen = LATENCY_WINDOW)
+
+
+    async def start(self, host = "127.0.0.1", port = 8765, path = None):
+        """
+        Starts listening on a Unix socket if a path is given, otherwise on TCP.
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self.handleConnection, path = path)
+        return await asyncio.start_server(self.handleConnection, host, port)
+
+
+    def close(self):
+        self.pool.shutdown(wait = False, cancel_futures = True)
+        self.manager.shutdown()
+
+
+    async def handleConnection(self, reader, writer):
+        tasks = {}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    await self.reply(writer, {"ok": False, "error": "Invalid JSON"})
+                    continue
+                if not isinstance(request, dict):
+                    await self.reply(writer, {"ok": False, "error": "Request must be a JSON object"})
+                    continue
+                # Request ids are used as dictionary keys, so lists and objects can not be ids
+                if isinstance(request.get("id"), (list, dict)) or isinstance(request.get("target"), (list, dict)):
+                    await self.reply(writer, {"id": request.get("id"), "ok": False,
+                                              "error": "id and target must be strings or numbers"})
+                    continue
+
+                if request.get("op") == "cancel":
+                    task = tasks.get(request.get("target"))
+                    cancelled = task is not None and task.cancel()
+                    await self.reply(writer, {"id": request.get("id"), "ok": cancelled})
+                    continue
+
+                # Each request runs in its own task so the connection keeps reading
+                # (and can receive cancellations) while a search is in progress
+                task = asyncio.create_task(self.handleRequest(request, writer))
+                if "id" in request:
+                    tasks[request["id"]] = task
+                    task.add_done_callback(lambda done, requestId = request["id"]: tasks.pop(requestId, None))
+                task.add_done_callback(lambda done, request = request: self.replyIfCancelled(done, request, writer))
+        except ConnectionError:
+            pass
+        finally:
+            for task in list(tasks.values()):
+                task.cancel()
+            writer.close()
+
+
+    async def reply(self, writer, response):
+        writer.write((json.dumps(response) + "\n").encode())
+        await writer.drain()
+
+
+    def replyIfCancelled(self, task, request, writer):
+        """
+        Replies to a request whose task was cancelled before it started running.
+        A task cancelled while running catches the cancellation in handleRequest
+        and replies itself, so it does not end up cancelled.
+        """
+        if not task.cancelled():
+            return
+        self.numCancelled += 1
+        if not writer.is_closing():
+            writer.write((json.dumps({"id": request.get("id"), "ok": False, "error": "cancelled"}) + "\n").encode())
+
+
+    async def handleRequest(self, request, writer):
+        response = {"id": request.get("id")}
+        try:
+            response.update(await self.dispatch(request))
+            response["ok"] = "error" not in response
+        except asyncio.CancelledError:
+            self.numCancelled += 1
+            response.update({"ok": False, "error": "cancelled"})
+        except (KeyError, TypeError, ValueError) as e:
+            response.update({"ok": False, "error": "Bad request: %s" % e})
+
+        try:
+            await self.reply(writer, response)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+
+    async def dispatch(self, request):
+        op = request.get("op")
+
+        if op == "new_game":
+            game = Game(next(self.gameIds), self.maxNodes, int(request.get("size", 6)))
+            self.games[game.gameId] = game
+            return game.getState()
+        if op == "stats":
+            return self.getStats()
+
+        game = self.games.get(request.get("game"))
+        if game is None:
+            return {"error": "Unknown game"}
+
+        if op == "state":
+            return game.getState()
+        if op == "close_game":
+            del self.games[game.gameId]
+            return {"game": game.gameId}
+        if op == "move":
+            async with game.lock:
+                move = (request["move"][0], bool(request["move"][1]))
+                error = game.play(tuple(request["piece"]), move)
+                if error is not None:
+                    return {"error": error}
+                return game.getState()
+        if op == "play":
+            return await self.play(game, request)
+
+        return {"error": "Unknown op %r" % op}
+
+
+    async def play(self, game, request):
+        """
+        Searches for a move in the process pool and plays it. A request that is cancelled
+        or runs out of time leaves the game unchanged and tells the search to stop.
+        A search is counted as in flight until its worker is done with it.
+        """
+        engine = request.get("engine", "mcts")
+        if engine not in ("mcts", "alphabeta"):
+            return {"error": "Unknown engine %r" % engine}
+        iterations = int(request.get("iterations", self.defaultIterations))
+        depth = int(request.get("depth", self.defaultDepth))
+        timeLimit = request.get("timeLimit")
+        if timeLimit is not None:
+            timeLimit = float(timeLimit)
+            if not timeLimit > 0:
+                raise ValueError("timeLimit must be a positive number of seconds")
+
+        async with game.lock:
+            if game.board.isTerminal()[0]:
+                return {"error": "Game is over"}
+
+            player = game.board.turn
+            start = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            stop = self.manager.Event()
+            # Only MCTS uses the agent, so alpha-beta requests do not send the tree to the worker and back
+            agent = game.agents[player] if engine == "mcts" else None
+            future = self.pool.submit(runEngine, game.board, agent, player, engine, iterations, depth, timeLimit, stop)
+            self.inFlight += 1
+            future.add_done_callback(lambda done: loop.call_soon_threadsafe(self.searchDone))
+            try:
+                if timeLimit is None:
+                    move, piece, score, agent = await asyncio.wrap_future(future)
+                else:
+                    # Allow for time spent waiting in the queue and moving the tree between processes
+                    move, piece, score, agent = await asyncio.wait_for(asyncio.wrap_future(future), timeLimit * 2 + 1)
+            except asyncio.TimeoutError:
+                stop.set()
+                self.numTimeouts += 1
+                return {"error": "timeout"}
+            except asyncio.CancelledError:
+                stop.set()
+                raise
+
+            self.numSearches += 1
+            self.latencies.append(time.perf_counter() - start)
+            if agent is not None:
+                game.agents[player] = agent
+
+            if move is None:
+                game.board.movesLeft = False
+                return game.getState()
+            game.play(piece, move)
+
+            response = game.getState()
+            response.update({"piece": list(piece), "move": list(move), "score": clampScore(score)})
+            return response
+
+
+    def searchDone(self):
+        self.inFlight -= 1
+
+
+    def getStats(self):
+        stats = {
+            "games": len(self.games),
+            "workers": self.workers,
+            "inFlight": self.inFlight,
+            "queueDepth": max(0, self.inFlight - self.workers),
+            "searches": self.numSearches,
+            "cancelled": self.numCancelled,
+            "timeouts": self.numTimeouts,
+        }
+        stats.update(percentiles(list(self.latencies)))
+        return stats
+
+
+class LoadGenerator:
+    """
+    Simulates many concurrent games against a GameServer. Each game uses its own
+    connection and alternates between an MCTS agent and an alpha-beta opponent,
+    as in Tests.py.
+    """
+
+    def __init__(self, numGames, iterations = 20, depth = 2, maxMoves = 60, timeLimit = None):
+        self.numGames = numGames
+        self.iterations = iterations
+        self.depth = depth
+        self.maxMoves = maxMoves
+        self.timeLimit = timeLimit
+        self.latencies = []
+        self.numRequests = 0
+
+
+    async def request(self, reader, writer, request):
+        start = time.perf_counter()
+        writer.write((json.dumps(request) + "\n").encode())
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        self.latencies.append(time.perf_counter() - start)
+        self.numRequests += 1
+        return response
+
+
+    async def connect(self, host, port, path):
+        if path is not None:
+            return await asyncio.open_unix_connection(path)
+        return await asyncio.open_connection(host, port)
+
+
+    async def playGame(self, host, port, path):
+        reader, writer = await self.connect(host, port, path)
+        state = await self.request(reader, writer, {"op": "new_game"})
+        gameId = state["game"]
+
+        while not state.get("gameOver") and state.get("moves", 0) < self.maxMoves:
+            request = {"op": "play", "game": gameId, "timeLimit": self.timeLimit}
+            if state["turn"] == AGENT:
+                request.update({"engine": "mcts", "iterations": self.iterations})
+            else:
+                request.update({"engine": "alphabeta", "depth": self.depth})
+            response = await self.request(reader, writer, request)
+            if not response["ok"]:
+                if response["error"] == "timeout": continue
+                break
+            state = response
+
+        await self.request(reader, writer, {"op": "close_game", "game": gameId})
+        writer.close()
+        return state.get("winner")
+
+
+    async def run(self, host = "127.0.0.1", port = 8765, path = None):
+        start = time.perf_counter()
+        winners = await asyncio.gather(*[self.playGame(host, port, path) for i in range(self.numGames)])
+        elapsed = time.perf_counter() - start
+
+        reader, writer = await self.connect(host, port, path)
+        serverStats = await self.request(reader, writer, {"op": "stats"})
+        writer.close()
+
+        print("%d games, %d requests in %.2fs (%.1f requests/sec)"
+              % (self.numGames, self.numRequests, elapsed, self.numRequests / elapsed))
+        print("wins:", dict(collections.Counter(winners)))
+        print("client latency (ms):", percentiles(self.latencies))
+        print("server stats:", serverStats)
+
+
+async def serve(args):
+    server = GameServer(args.workers, args.max_nodes)
+    listener = await server.start(args.host, args.port, args.unix)
+    print("Serving on", args.unix or "%s:%d" % (args.host, args.port))
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Checkers game server and load generator.")
+    parser.add_argument("mode", choices = ["serve", "load"])
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--unix", default = None, help = "Unix socket path (instead of TCP)")
+    parser.add_argument("--workers", type = int, default = None, help = "Engine processes (server)")
+    parser.add_argument("--max-nodes", type = int, default = 5000, help = "Node budget per MCTS tree (server)")
+    parser.add_argument("--games", type = int, default = 200, help = "Concurrent games (load)")
+    parser.add_argument("--iterations", type = int, default = 20, help = "MCTS iterations per move (load)")
+    parser.add_argument("--depth", type = int, default = 2, help = "Alpha-beta depth (load)")
+    parser.add_argument("--time-limit", type = float, default = None, help = "Seconds per search (load)")
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        asyncio.run(serve(args))
+    else:
+        generator = LoadGenerator(args.games, args.iterations, args.depth, timeLimit = args.time_limit)
+        asyncio.run(generator.run(args.host, args.port, args.unix))
@@ -0,0 +1,79 @@
+from MonteCarloTreeSearch import *
+
+
+def batchRollouts(leaves):
+    """
+    The default evaluator for LockstepMCTS. Plays a random rollout from every leaf,
+    then evaluates all of the final boards together with evaluateStates.
+    Takes a list of (agent, node) pairs and returns one value per pair, each from
+    the point of view of the agent whose tree the node belongs to.
+    """
+    boards = [agent.rollout(node) for agent, node in leaves]
+    players = [agent.player for agent, node in leaves]
+
+    # evaluateStates needs boards of one size, so group them if games of several sizes are mixed
+    values = [None] * len(leaves)
+    bySize = {}
+    for i, board in enumerate(boards):
+        bySize.setdefault(board.size, []).append(i)
+    for indices in bySize.values():
+        batch = evaluateStates([boards[i] for i in indices], [players[i] for i in indices])
+        for i, value in zip(indices, batch):
+            values[i] = value
+
+    return values
+
+
+class LockstepMCTS:
+    """
+    Runs the MCTS searches of many games in lockstep. In every step, each game's tree
+    selects its next leaf (or leavesPerGame leaves), the leaves of all games are
+    evaluated together in one call to the evaluator, and each value is backed up
+    into the tree it came from. With one leaf per game, each tree grows just as it
+    would in its own mcts call; only the order of the work changes, so that leaf
+    evaluations arrive in batches that a vectorized evaluator can fill.
+    With more than one leaf per game the search is only an approximation of mcts:
+    there is no virtual loss, so the leaves of a batch are all selected from the same
+    statistics and once a node is fully expanded they often follow the same path,
+    evaluating one leaf several times. Node budgets are enforced once the whole batch
+    has been backed up, so no selected leaf is evicted before its value arrives.
+    The evaluator takes a list of (agent, node) pairs and returns a list of values.
+    """
+
+    def __init__(self, evaluator = batchRollouts, leavesPerGame = 1):
+        self.evaluator = evaluator
+        self.leavesPerGame = leavesPerGame
+        self.numPlayouts = 0
+        self.numBatches = 0
+
+
+    def search(self, games, iterations):
+        """
+        Searches every game for the given number of iterations and returns the chosen
+        (move, piece) for each. games is a list of (agent, board, player) tuples, one
+        per game, where player is the player to move in that game.
+        """
+        roots = [agent.startSearch(board, player) for agent, board, player in games]
+        done = [0] * len(games)
+
+        iter = 0
+        while iter < iterations:
+            leaves = []
+            for i, (agent, board, player) in enumerate(games):
+                for j in range(min(self.leavesPerGame, iterations - iter)):
+                    leaves.append((i, agent.selectLeaf(roots[i], player)))
+
+            values = self.evaluator([(games[i][0], leaf) for i, leaf in leaves])
+            lastLeaves = {}
+            for (i, leaf), val in zip(leaves, values):
+                games[i][0].backProp(leaf, val)
+                lastLeaves[i] = leaf
+                done[i] += 1
+            for i, leaf in lastLeaves.items():
+                games[i][0].enforceBudget(roots[i], leaf)
+
+            self.numPlayouts += len(leaves)
+            self.numBatches += 1
+            iter += min(self.leavesPerGame, iterations - iter)
+
+        return [agent.finishSearch(root, count) for (agent, board, player), root, count in zip(games, roots, done)]
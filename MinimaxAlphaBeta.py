@@ -132,3 +132,11 @@ def alphaMinValue(player, depth, board, alpha, beta):
                 beta = minScore
         
     return minMove, minScore, minPiece
+
+
+# A side with no moves scores +-inf, which JSON can not hold, so scores that are
+# reported are clamped to the value evaluateState gives a finished game
+def clampScore(score):
+    if score is None:
+        return None
+    return max(-100, min(100, score))
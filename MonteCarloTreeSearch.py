@@ -1,35 +1,213 @@
+import threading
+import time
 from Board import *
 
+# When the node budget is exceeded, cold subtrees are evicted until the tree
+# is back down to this fraction of the budget
+EVICTION_TARGET = 0.9
+
+# Default limit on the iterations pondered after each move, so that an agent that is
+# never asked for another move does not keep searching (and growing its tree) forever
+MAX_PONDER_ITERATIONS = 20000
+
 class mctsAgent:
-    def __init__(self, player):
+    def __init__(self, player, statsTable = None, maxNodes = None, ponder = False, maxPonderIterations = MAX_PONDER_ITERATIONS):
         self.player = player
-        self.gameTree = []
+        # Nodes are keyed by the canonical hash of their position, and their visit counts
+        # and scores live in statsTable under the same key. Passing one statsTable to
+        # several agents lets them share statistics, including across colors. gameTree
+        # holds the first node created for each key; root is the root of the last search
+        # and roots every node that has been a root, which between them hold the whole tree.
+        # A statsTable entry is dropped once no node of any agent sharing it is left, so an
+        # agent that is done with a shared table should call releaseTree.
+        self.gameTree = {}
+        self.root = None
+        self.roots = []
+        self.statsTable = statsTable if statsTable is not None else {}
+
+        # Node budget for the tree (None for no limit) and counters used to monitor it
+        self.maxNodes = maxNodes
+        self.numNodes = 0
+        self.numEvictions = 0
+        self.numEvictedNodes = 0
+        self.numDiscardedNodes = 0
+        self.clock = 0
+
+        # With ponder set, the tree keeps growing in a background thread after each move
+        # until the next call to mcts. searchHistory records, for every move, how many
+        # iterations were run and how many of the reused root's visits came from pondering.
+        self.ponder = ponder
+        self.maxPonderIterations = maxPonderIterations
+        self.ponderThread = None
+        self.ponderStop = None
+        self.ponderIterations = 0
+        self.ponderSession = 0
+        self.searchHistory = []
     
 
-    def mcts(self, board, player, iterations):
-        state = board.getBoard()
-        currentNode = None
+    def getKey(self, board, player):
+        return board.getCanonicalHash(player, self.player)
 
-        for node in self.gameTree:
-            if (node.getState() == state).all():
-                currentNode = node
 
-        if currentNode is not None:
-            currentNode.removeParent()
-        else:
-            allLegalMoves = board.getAllLegalMoves(player)
-            currentNode = Node(player, state, None, len(allLegalMoves))
-            self.gameTree.append(currentNode)
+    # Returns the statistics for a new node with the given key
+    def getStats(self, key):
+        if key not in self.statsTable:
+            self.statsTable[key] = NodeStats()
+        stats = self.statsTable[key]
+        stats.numNodes += 1
+        return stats
+
+
+    # Returns the chosen (move, piece), or (None, None) if the player has no legal moves
+    def mcts(self, board, player, iterations, timeLimit = None, stop = None):
+        currentNode = self.startSearch(board, player)
+        if currentNode.getNumChildren() == 0:
+            return self.finishSearch(currentNode, 0)
+
+        # With a time limit, stop early once it runs out, and with a stop event (such as a
+        # threading or multiprocessing Event), once it is set (always completing one iteration)
+        deadline = None
+        if timeLimit is not None:
+            deadline = time.perf_counter() + timeLimit
 
         iter = 0
         while iter < iterations:
-            nextNode = self.chooseNode(currentNode, player)
+            if deadline is not None and iter > 0 and time.perf_counter() >= deadline:
+                break
+            if stop is not None and iter > 0 and stop.is_set():
+                break
+            nextNode = self.selectLeaf(currentNode, player)
             val = self.simulate(nextNode)
-            self.backProp(nextNode, val)
+            self.update(currentNode, nextNode, val)
             iter += 1
 
+        return self.finishSearch(currentNode, iter)
+
+
+    # Finds (or creates) the root node for a search from the given board, reusing the
+    # existing tree if the position has already been expanded. mcts is made up of
+    # startSearch, repeated selectLeaf / simulate / update iterations and finishSearch,
+    # which lets a scheduler interleave the iterations of several agents.
+    def startSearch(self, board, player):
+        pondered = self.stopPondering()
+
+        state = board.getBoard().copy()
+        key = self.getKey(board, player)
+        currentNode = self.findNode(key)
+
+        ponderHits = 0
+        if currentNode is not None:
+            # Detach the new root completely, so that a repeated position that
+            # re-roots the search above it can not walk back into it
+            if currentNode.parent is not None:
+                currentNode.parent.removeChild(currentNode)
+            if currentNode.ponderSession == self.ponderSession:
+                ponderHits = currentNode.ponderVisits
+        else:
+            allLegalMoves = board.getAllLegalMoves(player)
+            currentNode = Node(player, state, None, len(allLegalMoves), self.getStats(key), key)
+            self.gameTree[key] = currentNode
+            self.numNodes += 1
+
+        if not any(root is currentNode for root in self.roots):
+            self.roots.append(currentNode)
+        if self.maxNodes is not None:
+            self.discardOutsideRoot(currentNode)
+
+        self.root = currentNode
+        self.searchHistory.append({"iterations": 0, "ponderIterations": pondered, "ponderHits": ponderHits})
+        return currentNode
+
+
+    # Returns the node for a position, preferring the shallowest one below the last root.
+    # A position reached by transposition has several nodes, and only the ones below the
+    # last root hold the statistics of the line that was actually played.
+    def findNode(self, key):
+        if self.root is not None:
+            for node in self.getSubtree(self.root):
+                if node.key == key:
+                    return node
+
+        return self.gameTree.get(key)
+
+
+    def selectLeaf(self, currentNode, player):
+        self.clock += 1
+        return self.chooseNode(currentNode, player)
+
+
+    def update(self, currentNode, leaf, val):
+        self.backProp(leaf, val)
+        self.enforceBudget(currentNode, leaf)
+
+
+    # Evicts cold subtrees if the tree is over its node budget, keeping the path to leaf.
+    # No other leaf may be waiting to be backed up, since its path is not protected.
+    def enforceBudget(self, currentNode, leaf):
+        if self.maxNodes is not None and self.numNodes > self.maxNodes:
+            self.evictColdSubtrees(currentNode, leaf)
+
+
+    def finishSearch(self, currentNode, iterations):
         move, piece = self.bestMove(currentNode)
+        self.searchHistory[-1]["iterations"] = iterations
+
+        # There is nothing to ponder once our move has ended the game
+        if self.ponder:
+            for child in currentNode.getChildren():
+                if child.getMove() == (move, piece) and not self.isTerminalNode(child):
+                    self.startPondering(child)
+                    break
+
         return move, piece
+
+
+    # Grows the tree below the position reached by our move while the opponent thinks
+    def startPondering(self, node):
+        self.ponderIterations = 0
+        self.ponderSession += 1
+        self.ponderStop = threading.Event()
+        self.ponderThread = threading.Thread(target = self.ponderLoop, args = (node, self.ponderStop), daemon = True)
+        self.ponderThread.start()
+
+
+    def ponderLoop(self, node, stop):
+        while not stop.is_set():
+            if self.maxPonderIterations is not None and self.ponderIterations >= self.maxPonderIterations:
+                break
+            self.clock += 1
+            nextNode = self.chooseNode(node, node.getPlayer())
+            val = self.simulate(nextNode)
+            self.backProp(nextNode, val, pondering = True)
+            self.ponderIterations += 1
+
+            # The search keeps returning to a finished game, so stop early
+            if self.isTerminalNode(nextNode):
+                break
+
+            if self.maxNodes is not None and self.numNodes > self.maxNodes:
+                self.evictColdSubtrees(node, nextNode)
+
+
+    def isTerminalNode(self, node):
+        if node.getNumChildren() == 0:
+            return True
+        board = Board()
+        board.setBoard(node.getState())
+        return board.isTerminal()[0]
+
+
+    # Stops the background search, returning how many iterations it ran
+    def stopPondering(self):
+        if self.ponderThread is None:
+            return 0
+
+        self.ponderStop.set()
+        self.ponderThread.join()
+        self.ponderThread = None
+        self.ponderStop = None
+
+        return self.ponderIterations
         
 
     def chooseNode(self, node, player):
@@ -37,14 +215,14 @@ class mctsAgent:
 
         board = Board()  
         board.setBoard(currentState)
+        player = node.getPlayer()
 
         while node.getNumChildren() > 0:
             if board.isTerminal()[0]:
                 return node
-
-            legalMoves = board.getAllLegalMoves(player)
                     
-            if len(node.getChildren()) < len(legalMoves):
+            if len(node.getChildren()) < node.getNumChildren():
+                legalMoves = board.getAllLegalMoves(player)
                 
                 unexpandedMoves = []
                 for move in legalMoves:
@@ -57,15 +235,21 @@ class mctsAgent:
                 nextState = nextBoard.getBoard()
                 nextPlayer = nextBoard.nextPlayer(player)
                 numChildren = len(nextBoard.getAllLegalMoves(nextPlayer))
+                key = self.getKey(nextBoard, nextPlayer)
                 
-                child = Node(nextPlayer, nextState, move, numChildren)
+                child = Node(nextPlayer, nextState, move, numChildren, self.getStats(key), key)
                 node.addChild(child)
-                self.gameTree.append(child)
+                self.gameTree.setdefault(key, child)
+                self.numNodes += 1
 
                 return child
             
             else:
+                # Follow the child's move so the board and player to move stay in step with the node
                 node = self.getBestChild(node)
+                move, piece = node.getMove()
+                board = board.testMove(piece, move)
+                player = node.getPlayer()
 
         return node
         
@@ -73,13 +257,16 @@ class mctsAgent:
     def getBestChild(self, node):
         maxUCB = -float("inf")
         maxChild = None
+        # Scores are from our point of view, so the opponent picks its replies by their negation
+        sign = 1 if node.getPlayer() == self.player else -1
 
         for child in node.getChildren():
-            if self.getUCBVal(child) == float("inf"):
+            ucb = self.getUCBVal(child, sign)
+            if ucb == float("inf"):
                 return child
             
-            if self.getUCBVal(child) > maxUCB:
-                maxUCB = self.getUCBVal(child)
+            if ucb > maxUCB:
+                maxUCB = ucb
                 maxChild = child
 
         return maxChild
@@ -87,14 +274,21 @@ class mctsAgent:
 
     def bestMove(self, node):
         bestChild = self.getBestChild(node)
+        if bestChild is None:
+            return None, None
         move = bestChild.getMove()
 
         return move[0], move[1]
 
 
     def simulate(self, node):
+        return self.rollout(node).evaluateState(self.player)
+
+
+    # Plays random moves from the node's position and returns the final board
+    def rollout(self, node):
         board = Board()
-        board.setBoard(node.getState())
+        board.setBoard(node.getState().copy())
         player = node.getPlayer()
 
         iter = 0
@@ -107,21 +301,116 @@ class mctsAgent:
             player = board.nextPlayer(player)
             iter += 1
 
-        return board.evaluateState(self.player)
+        return board
 
 
-    def backProp(self, node, val):
-        while node.parent is not None:
-            node.addVisit()
-            node.addNodeValue(val)
+    # Nodes of transposed positions share one NodeStats, which is only updated once per playout
+    def backProp(self, node, val, pondering = False):
+        updated = set()
+        while node is not None:
+            if id(node.stats) not in updated:
+                updated.add(id(node.stats))
+                node.addVisit()
+                node.addNodeValue(val)
+            node.lastTouched = self.clock
+            if pondering: node.addPonderVisit(self.ponderSession)
 
             node = node.parent
 
-        node.addVisit()
-        node.addNodeValue(val)
+
+    # Current size of the tree and how many nodes have been removed from it
+    def getTreeStats(self):
+        return {
+            "nodes": self.numNodes,
+            "maxNodes": self.maxNodes,
+            "evictions": self.numEvictions,
+            "evictedNodes": self.numEvictedNodes,
+            "discardedNodes": self.numDiscardedNodes,
+        }
+
+
+    def getSubtree(self, node):
+        nodes = [node]
+        i = 0
+        while i < len(nodes):
+            nodes.extend(nodes[i].getChildren())
+            i += 1
+
+        return nodes
+
+
+    # Drops every node that is no longer below the current root, since
+    # chooseNode can not reach them again once the game has moved past them
+    def discardOutsideRoot(self, root):
+        subtree = self.getSubtree(root)
+        kept = set(id(node) for node in subtree)
+        for top in self.roots:
+            for node in self.getSubtree(top):
+                if id(node) not in kept and not node.evicted:
+                    self.releaseNode(node)
+                    self.numDiscardedNodes += 1
+
+        self.roots = [root]
+        self.gameTree = {}
+        for node in subtree:
+            self.gameTree.setdefault(node.key, node)
+
+
+    # Removes a node from the tree. Its statistics are dropped from statsTable
+    # once no other node, of this agent or any agent sharing the table, uses them.
+    def releaseNode(self, node):
+        node.evicted = True
+        if self.gameTree.get(node.key) is node:
+            del self.gameTree[node.key]
+
+        node.stats.numNodes -= 1
+        if node.stats.numNodes == 0 and self.statsTable.get(node.key) is node.stats:
+            del self.statsTable[node.key]
+        self.numNodes -= 1
+
+
+    # Releases every node, for an agent that is finished with a shared statsTable
+    def releaseTree(self):
+        self.stopPondering()
+        for top in self.roots:
+            for node in self.getSubtree(top):
+                if not node.evicted:
+                    self.releaseNode(node)
+
+        self.roots = []
+        self.root = None
+        self.gameTree = {}
+
+
+    # Evicts the least visited, least recently touched subtrees until the tree is back
+    # under its node budget. The root, its children and the path down to the latest
+    # leaf are kept. Evicted moves are re-expanded by chooseNode if the search returns to them.
+    def evictColdSubtrees(self, root, leaf):
+        protected = set(id(child) for child in root.getChildren())
+        node = leaf
+        while node is not None:
+            protected.add(id(node))
+            node = node.parent
+
+        candidates = [node for node in self.getSubtree(root) if id(node) not in protected]
+        candidates.sort(key = lambda node: (node.getNumVisits(), node.lastTouched))
+
+        target = int(self.maxNodes * EVICTION_TARGET)
+        for node in candidates:
+            if self.numNodes <= target:
+                break
+            if node.evicted:    # already removed along with an evicted ancestor
+                continue
+
+            node.parent.removeChild(node)
+            for evicted in self.getSubtree(node):
+                self.releaseNode(evicted)
+                self.numEvictedNodes += 1
+
+        self.numEvictions += 1
         
 
-    def getUCBVal(self, node):
+    def getUCBVal(self, node, sign = 1):
         if node.getNumVisits() == 0:
             return float("inf")
         
@@ -132,30 +421,44 @@ class mctsAgent:
 
         for child in children:
             if child.getNumVisits() == 0: continue
-            avgVal += child.getNodeScore()
+            avgVal += child.getNodeScore() / child.getNumVisits()
             count += 1
 
         if count != 0:
            avgVal = avgVal / count
         else:
-            avgVal = node.getNodeScore()
-        ucb = avgVal + 2 * np.sqrt(np.log(node.getParentNumVisits()) / node.getNumVisits())
+            avgVal = node.getNodeScore() / node.getNumVisits()
+        # The parent can still be unvisited when several leaves are selected before any is backed
+        # up (as in LockstepMCTS) and this child shares its statistics with a transposed position
+        ucb = sign * avgVal + 2 * np.sqrt(np.log(max(node.getParentNumVisits(), 1)) / node.getNumVisits())
 
         return ucb
     
 
 
+class NodeStats:
+    def __init__(self):
+        self.numVisits = 0
+        self.totalScore = 0
+        self.numNodes = 0   # live nodes using these statistics
+
+
+
 class Node:
-    def __init__(self, player, state, move, numChildren):
+    def __init__(self, player, state, move, numChildren, stats = None, key = None):
         self.player = player
+        self.key = key
         self.state = state 
         self.move = move
         self.parent = None
         self.children = []
         self.expandedMoves = set()
-        self.numVisits = 0
-        self.totalScore = 0
+        self.stats = stats if stats is not None else NodeStats()
         self.numChildren = numChildren
+        self.lastTouched = 0
+        self.evicted = False
+        self.ponderVisits = 0   # visits from the pondering session numbered ponderSession
+        self.ponderSession = 0
 
     def getPlayer(self):
         return self.player
@@ -173,26 +476,37 @@ class Node:
         return self.numChildren
     
     def getNumVisits(self):
-        return self.numVisits
+        return self.stats.numVisits
     
     def getParentNumVisits(self):
         return self.parent.getNumVisits()
     
     def getNodeScore(self):
-        if self.numVisits == 0:
+        if self.stats.numVisits == 0:
             return float("inf")
-        return self.totalScore
+        return self.stats.totalScore
     
     def addChild(self, child):
         self.expandedMoves.add(child.getMove())
         self.children.append(child)
         child.parent = self
 
+    def removeChild(self, child):
+        self.expandedMoves.discard(child.getMove())
+        self.children.remove(child)
+        child.parent = None
+
     def addVisit(self):
-        self.numVisits += 1
+        self.stats.numVisits += 1
     
     def addNodeValue(self, val):
-        self.totalScore += val
+        self.stats.totalScore += val
+
+    def addPonderVisit(self, session):
+        if self.ponderSession != session:
+            self.ponderSession = session
+            self.ponderVisits = 0
+        self.ponderVisits += 1
 
     def removeParent(self):
         self.parent = None
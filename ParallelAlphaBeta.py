@@ -0,0 +1,335 @@
+import multiprocessing as mp
+import queue
+from multiprocessing import shared_memory
+from MinimaxAlphaBeta import *
+
+# Bound types stored with each transposition table entry
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+NO_MOVE = 0xFF
+SCORE_OFFSET = 0x8000
+SCORE_LIMIT = 0x7FFF    # scores of +/- infinity are clamped to this value when stored
+
+# Xored into the key of a max node searched for the opponent (as when alphaMaxValue is
+# called for OPP at the root) so its entry is never mistaken for an opponent min node
+OPP_MAX_KEY = 0x2545F4914F6CDD1D
+
+
+class SharedTranspositionTable:
+    """
+    A transposition table stored in a multiprocessing.shared_memory block so that
+    every worker process of a parallel search reads and writes the same entries.
+    Each entry is two 64-bit words, (key ^ data, data). Entries are written without
+    locks, so a probe only trusts an entry when xoring its two words gives back the
+    probed key; an entry torn by two concurrent writers fails the check and is ignored.
+    """
+
+    def __init__(self, size, name = None):
+        self.size = size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create = True, size = size * 16)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name = name)
+            self.owner = False
+        self.table = np.ndarray((size, 2), dtype = np.uint64, buffer = self.shm.buf)
+        if self.owner:
+            self.table[:] = 0
+
+
+    def getName(self):
+        """
+        Returns the name used by worker processes to attach to the table.
+        """
+        return self.shm.name
+
+
+    def probe(self, key):
+        """
+        Returns the (score, depth, flag, moveIndex) stored for the given key,
+        or None if there is no verified entry for it.
+        """
+        slot = key % self.size
+        data = int(self.table[slot, 1])
+        check = int(self.table[slot, 0])
+        if data == 0 or check ^ data != key:
+            return None
+
+        return self.unpack(data)
+
+
+    def store(self, key, score, depth, flag, moveIndex):
+        """
+        Stores a search result for the given key, always replacing the previous entry.
+        """
+        data = self.pack(score, depth, flag, moveIndex)
+        slot = key % self.size
+        self.table[slot, 1] = data
+        self.table[slot, 0] = key ^ data
+
+
+    def pack(self, score, depth, flag, moveIndex):
+        """
+        Packs an entry into a single 64-bit word.
+        """
+        score = int(max(-SCORE_LIMIT, min(SCORE_LIMIT, score)))
+        return (score + SCORE_OFFSET) | (depth << 16) | (flag << 24) | (moveIndex << 32)
+
+
+    def unpack(self, data):
+        """
+        Unpacks a 64-bit word into (score, depth, flag, moveIndex).
+        """
+        score = (data & 0xFFFF) - SCORE_OFFSET
+        if score == SCORE_LIMIT:
+            score = float("inf")
+        elif score == -SCORE_LIMIT:
+            score = -float("inf")
+        depth = (data >> 16) & 0xFF
+        flag = (data >> 24) & 0x3
+        moveIndex = (data >> 32) & 0xFF
+
+        return score, depth, flag, moveIndex
+
+
+    def close(self):
+        """
+        Detaches from the shared memory block, releasing it if this process created it.
+        """
+        self.table = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SearchAborted(Exception):
+    """
+    Raised inside a worker when the main process asks the search to stop.
+    """
+    pass
+
+
+class LazySMPWorker:
+    """
+    Runs an iterative deepening alpha-beta search that shares results with the
+    other workers through a SharedTranspositionTable.
+    Worker 0 searches moves in their natural order, while helper workers shuffle
+    their move order and odd-numbered helpers search one ply deeper so that the
+    workers explore different parts of the tree and fill the table for each other.
+    """
+
+    def __init__(self, workerId, table, stopEvent = None):
+        self.workerId = workerId
+        self.table = table
+        self.stopEvent = stopEvent
+        self.rng = random.Random(workerId)
+        self.nodes = 0
+
+
+    def search(self, player, depth, board):
+        """
+        Yields (depth, move, score, piece) after every completed iteration.
+        """
+        maxDepth = depth + (self.workerId % 2)
+        for currentDepth in range(1, maxDepth + 1):
+            move, score, piece = self.maxValue(player, currentDepth, board, -float("inf"), float("inf"))
+            yield currentDepth, move, score, piece
+
+
+    def orderMoves(self, board, player, key):
+        """
+        Returns the legal moves for a player with the table's best move first.
+        Helper workers shuffle the remaining moves.
+        """
+        moves = list(enumerate(board.getAllLegalMoves(player)))
+        if self.workerId != 0:
+            self.rng.shuffle(moves)
+
+        entry = self.table.probe(key)
+        if entry is not None and entry[3] != NO_MOVE:
+            for i in range(len(moves)):
+                if moves[i][0] == entry[3]:
+                    moves.insert(0, moves.pop(i))
+                    break
+
+        return moves
+
+
+    def alphaBeta(self, player, depth, board, alpha, beta):
+        if depth == 0 or board.isTerminal()[0]:
+            return board.evaluateState(player)
+        if player == AGENT:
+            return self.maxValue(AGENT, depth, board, alpha, beta)[1]
+        else:
+            return self.minValue(OPP, depth, board, alpha, beta)[1]
+
+
+    def probeScore(self, key, depth, alpha, beta):
+        """
+        Returns a score from the table that can be used in place of searching
+        the current node, or None if the stored entry is too shallow or its bound
+        does not decide the node.
+        """
+        entry = self.table.probe(key)
+        if entry is None:
+            return None
+
+        score, entryDepth, flag, moveIndex = entry
+        if entryDepth < depth:
+            return None
+        if flag == EXACT or (flag == LOWER and score > beta) or (flag == UPPER and score < alpha):
+            return score
+
+        return None
+
+
+    def countNode(self):
+        self.nodes += 1
+        if self.stopEvent is not None and self.nodes % 1024 == 0 and self.stopEvent.is_set():
+            raise SearchAborted()
+
+
+    def maxValue(self, player, depth, board, alpha, beta):
+        self.countNode()
+        nextTurn = board.nextPlayer(player)
+        key = board.getHash(player)
+        if player == OPP:
+            key ^= OPP_MAX_KEY
+        alphaOrig = alpha
+
+        maxScore = -float("inf")
+        maxMove = None
+        maxPiece = None
+        maxIndex = NO_MOVE
+
+        for index, (move, piece) in self.orderMoves(board, player, key):
+            nextState = board.testMove(piece, move)
+            nextKey = nextState.getHash(nextTurn)
+            score = self.probeScore(nextKey, depth - 1, alpha, beta)
+            if score is None:
+                score = self.alphaBeta(nextTurn, depth - 1, nextState, alpha, beta)
+
+            if score > maxScore:
+                maxScore = score
+                maxMove = move
+                maxPiece = piece
+                maxIndex = index
+            if maxScore > beta:
+                self.table.store(key, maxScore, depth, LOWER, maxIndex)
+                return maxMove, maxScore, maxPiece
+            elif maxScore > alpha:
+                alpha = maxScore
+
+        flag = UPPER if maxScore <= alphaOrig else EXACT
+        self.table.store(key, maxScore, depth, flag, maxIndex)
+        return maxMove, maxScore, maxPiece
+
+
+    def minValue(self, player, depth, board, alpha, beta):
+        self.countNode()
+        nextTurn = board.nextPlayer(player)
+        key = board.getHash(player)
+        betaOrig = beta
+
+        minScore = float("inf")
+        minMove = None
+        minPiece = None
+        minIndex = NO_MOVE
+
+        for index, (move, piece) in self.orderMoves(board, player, key):
+            nextState = board.testMove(piece, move)
+            nextKey = nextState.getHash(nextTurn)
+            score = self.probeScore(nextKey, depth - 1, alpha, beta)
+            if score is None:
+                score = self.alphaBeta(nextTurn, depth - 1, nextState, alpha, beta)
+
+            if score < minScore:
+                minScore = score
+                minMove = move
+                minPiece = piece
+                minIndex = index
+            if minScore < alpha:
+                self.table.store(key, minScore, depth, UPPER, minIndex)
+                return minMove, minScore, minPiece
+            elif minScore < beta:
+                beta = minScore
+
+        flag = LOWER if minScore >= betaOrig else EXACT
+        self.table.store(key, minScore, depth, flag, minIndex)
+        return minMove, minScore, minPiece
+
+
+def lazySMPWorkerMain(workerId, tableName, tableSize, player, depth, board, results, stopEvent):
+    """
+    Entry point of a worker process. Reports every completed iteration
+    to the main process through the results queue.
+    """
+    table = SharedTranspositionTable(tableSize, tableName)
+    worker = LazySMPWorker(workerId, table, stopEvent)
+    try:
+        for result in worker.search(player, depth, board):
+            results.put((workerId, worker.nodes) + result)
+    except SearchAborted:
+        pass
+    finally:
+        results.put((workerId, worker.nodes, None, None, None, None))
+        table.close()
+
+
+def parallelAlphaMaxValue(player, depth, board, workers = 4, tableSize = 1 << 20, stats = None):
+    """
+    Lazy SMP version of alphaMaxValue. Starts the given number of worker processes
+    on the same root, all sharing one transposition table, and returns the
+    (move, score, piece) of the deepest iteration completed by any worker once
+    worker 0 has finished searching to the requested depth.
+    If a stats dictionary is given it is filled with the completed depth and
+    the total number of nodes searched by all workers.
+    """
+    table = SharedTranspositionTable(tableSize)
+    results = mp.Queue()
+    stopEvent = mp.Event()
+    processes = []
+
+    best = (0, None, -float("inf"), None)
+    nodes = {}
+    running = workers
+    try:
+        for workerId in range(workers):
+            process = mp.Process(target = lazySMPWorkerMain,
+                                 args = (workerId, table.getName(), tableSize, player, depth, board, results, stopEvent))
+            process.start()
+            processes.append(process)
+
+        while running > 0:
+            try:
+                workerId, workerNodes, resultDepth, move, score, piece = results.get(timeout = 1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+
+            nodes[workerId] = workerNodes
+            if resultDepth is None:     # worker has exited
+                running -= 1
+                continue
+            if resultDepth > best[0]:
+                best = (resultDepth, move, score, piece)
+            if workerId == 0 and resultDepth == depth:
+                stopEvent.set()
+
+        for process in processes:
+            process.join()
+    finally:
+        stopEvent.set()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        table.close()
+
+    if stats is not None:
+        stats["depth"] = best[0]
+        stats["nodes"] = sum(nodes.values())
+
+    return best[1], best[2], best[3]
@@ -0,0 +1,136 @@
+import argparse
+import concurrent.futures
+import time
+from Board import *
+
+# Leaf counts from the starting position for depths 1, 2, 3, ... with the agent to move,
+# used by --verify to check that move generation has not changed
+REFERENCE_COUNTS = {
+    6: [5, 25, 141, 770, 4222, 22223, 115082],
+    8: [7, 49, 379, 2872, 23582, 189143],
+    10: [9, 81, 793, 7654, 79010],
+}
+
+
+def perft(board, player, depth, table = None):
+    """
+    Returns the number of positions reached after playing every sequence of depth
+    legal moves from the given board. If a table (dictionary) is given, counts are
+    stored in it by position hash and depth and reused for transposed positions.
+    """
+    if depth < 0:
+        raise ValueError("perft depth must not be negative")
+    if depth == 0:
+        return 1
+
+    if table is not None:
+        key = (board.getHash(player), depth)
+        if key in table:
+            return table[key]
+
+    moves = board.getAllLegalMoves(player)
+    if depth == 1:
+        return len(moves)
+
+    nextPlayer = board.nextPlayer(player)
+    count = 0
+    for move, piece in moves:
+        count += perft(board.testMove(piece, move), nextPlayer, depth - 1, table)
+
+    if table is not None:
+        table[key] = count
+
+    return count
+
+
+def perftMove(board, player, depth, move, piece, useTable):
+    """
+    Returns the perft count below a single root move. Used by the worker processes of divide.
+    """
+    table = {} if useTable else None
+    return perft(board.testMove(piece, move), board.nextPlayer(player), depth - 1, table)
+
+
+def divide(board, player, depth, useTable = False, workers = 1):
+    """
+    Returns a list of ((move, piece), count) pairs giving the perft count below each root move.
+    With more than one worker, the root moves are split across a process pool,
+    each process keeping its own hash table.
+    """
+    if depth < 1:
+        raise ValueError("divide needs a depth of at least 1")
+
+    moves = board.getAllLegalMoves(player)
+
+    if workers <= 1:
+        table = {} if useTable else None
+        return [((move, piece), perft(board.testMove(piece, move), board.nextPlayer(player), depth - 1, table))
+                for move, piece in moves]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = [pool.submit(perftMove, board, player, depth, move, piece, useTable) for move, piece in moves]
+        return [((move, piece), future.result()) for (move, piece), future in zip(moves, futures)]
+
+
+def verify(sizes, useTable, workers):
+    """
+    Checks the perft counts from the starting position of each board size against
+    REFERENCE_COUNTS. Returns True if all of them match.
+    """
+    ok = True
+    for size in sizes:
+        if size not in REFERENCE_COUNTS:
+            print("%dx%d: no reference counts" % (size, size))
+            ok = False
+            continue
+
+        for depth, expected in enumerate(REFERENCE_COUNTS[size], 1):
+            count = sum(count for move, count in divide(Board(size), AGENT, depth, useTable, workers))
+            status = "ok" if count == expected else "MISMATCH (expected %d)" % expected
+            print("%dx%d perft(%d) = %d %s" % (size, size, depth, count, status))
+            ok = ok and count == expected
+
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Count the positions reachable from the starting position.")
+    parser.add_argument("--depth", type = int, default = 6)
+    parser.add_argument("--size", type = int, default = None, help = "Board size (default 6, or every size in REFERENCE_COUNTS with --verify)")
+    parser.add_argument("--player", choices = [AGENT, OPP], default = AGENT, help = "Player to move")
+    parser.add_argument("--workers", type = int, default = 1, help = "Processes to split the root moves across")
+    parser.add_argument("--hash", action = "store_true",
+                        help = "Reuse counts for transposed positions (faster, but the timing then includes table hits)")
+    parser.add_argument("--divide", action = "store_true", help = "Print the count below each root move")
+    parser.add_argument("--verify", action = "store_true", help = "Check the counts against REFERENCE_COUNTS")
+    args = parser.parse_args()
+
+    if args.depth < 0:
+        parser.error("--depth must not be negative")
+
+    if args.verify:
+        sizes = [args.size] if args.size is not None else sorted(REFERENCE_COUNTS)
+        raise SystemExit(0 if verify(sizes, args.hash, args.workers) else 1)
+
+    size = args.size if args.size is not None else 6
+    try:
+        board = Board(size)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.depth == 0:
+        print("perft(0) = 1")
+        raise SystemExit(0)
+
+    start = time.perf_counter()
+    counts = divide(board, args.player, args.depth, args.hash, args.workers)
+    elapsed = time.perf_counter() - start
+
+    if args.divide:
+        for (move, piece), count in counts:
+            print("%s %s%s: %d" % (piece, move[0], " (jump)" if move[1] else "", count))
+
+    # With hashing, leaves counted from the table were never generated, so the rate is not a move generation speed
+    total = sum(count for move, count in counts)
+    rate = "hashed" if args.hash else "%.0f leaves/sec" % (total / elapsed)
+    print("perft(%d) = %d in %.3fs (%s)" % (args.depth, total, elapsed, rate))
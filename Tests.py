@@ -19,6 +19,9 @@ class MCTSvsMinimax:
             while not board.isTerminal()[0]:
                 if turn == AGENT:
                     move, piece = agent.mcts(board, AGENT, 5)
+                    if move == None:
+                        board.movesLeft = False
+                        break
                 else:
                     move, score, piece, = maxValue(OPP, 3, board)             
                     if move == None: 
@@ -59,6 +62,9 @@ class MCTSvsAlphaBeta:
             while not board.isTerminal()[0]:
                 if turn == AGENT:
                     move, piece = agent.mcts(board, AGENT, 5)
+                    if move == None:
+                        board.movesLeft = False
+                        break
                 else:
                     move, score, piece, = alphaMaxValue(OPP, 3, board, -float("inf"), float("inf"))             
                     if move == None: 